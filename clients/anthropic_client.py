@@ -1,22 +1,67 @@
 # src/chatbot/anthropic_client.py
 import os
-import time
-from typing import List, Dict
+import hashlib
+import importlib.util
+import logging
+from collections import OrderedDict
+from typing import Callable, List, Dict, Optional
 import anthropic
+import httpx
 from dotenv import load_dotenv
 
+from clients.response_cache import ResponseCache
+
+# Hijo del logger del chatbot: hereda sus handlers (archivo y consola para WARNING+)
+logger = logging.getLogger("MCPChatbot.anthropic")
+
+# El .env solo se lee la primera vez que se crea un cliente
+_env_loaded = False
+
+# Clientes HTTP compartidos por todas las instancias: las conexiones TLS a la API
+# se mantienen vivas y se reutilizan (HTTP/2 si el paquete h2 está instalado)
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+_HTTP2 = importlib.util.find_spec("h2") is not None
+_http_client = None
+_async_http_client = None
+
+
+def _shared_http_clients():
+    """Crea (una sola vez) los clientes httpx síncrono y async compartidos"""
+    global _http_client, _async_http_client
+    if _http_client is None:
+        _http_client = anthropic.DefaultHttpxClient(http2=_HTTP2, limits=_HTTP_LIMITS)
+        _async_http_client = anthropic.DefaultAsyncHttpxClient(http2=_HTTP2, limits=_HTTP_LIMITS)
+    return _http_client, _async_http_client
+
 class AnthropicClient:
-    def __init__(self, model_name: str = "claude-3-5-haiku-20241022", api_key: str = None):
+    def __init__(self, model_name: str = "claude-3-5-haiku-20241022", api_key: str = None,
+                 cache_size: int = 128, cache_ttl: float = 300.0):
         """
         Cliente para interactuar con Anthropic Claude API
         
         Args:
             model_name: Nombre del modelo Claude a usar
             api_key: Clave API de Anthropic (si no se proporciona, se lee del .env)
+            cache_size: Máximo de respuestas en caché (0 para desactivarla)
+            cache_ttl: Segundos que vale una respuesta en caché si la temperatura no es 0
         """
-        load_dotenv()
+        global _env_loaded
+        if not _env_loaded:
+            load_dotenv()
+            _env_loaded = True
         
         self.model_name = model_name
+        self.temperature = 0.7
+        
+        # Caché LRU de respuestas exactas: misma petición → misma respuesta sin llamar a la API
+        # (con muestreo aleatorio solo durante cache_ttl segundos)
+        self.cache_ttl = cache_ttl
+        self._response_cache = ResponseCache(cache_size)
+        self.last_usage = {}
+        
+        # Conteos exactos de tokens por texto (LRU): se llenan con el uso que devuelve la API
+        self._token_counts = OrderedDict()
+        self.token_cache_size = 4096
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
         
         if not self.api_key:
@@ -27,11 +72,14 @@ class AnthropicClient:
         
         # Inicializar cliente de Anthropic
         try:
-            self.client = anthropic.Anthropic(api_key=self.api_key)
+            http_client, async_http_client = _shared_http_clients()
+            self.client = anthropic.Anthropic(api_key=self.api_key, http_client=http_client)
+            self.aclient = anthropic.AsyncAnthropic(api_key=self.api_key, http_client=async_http_client)
             print(f"✅ Cliente Anthropic inicializado con modelo: {model_name}")
             
-            # Verificar conexión con una consulta simple
-            self._test_connection()
+            # Verificar conexión con una consulta simple (cuesta una llamada a la API: opcional)
+            if os.getenv("ANTHROPIC_HEALTHCHECK") == "1":
+                self._test_connection()
             
         except Exception as e:
             raise ConnectionError(f"Error inicializando cliente Anthropic: {str(e)}")
@@ -61,38 +109,140 @@ class AnthropicClient:
             Respuesta del modelo
         """
         try:
-            start_time = time.time()
-            
             # Construir mensajes en formato de Anthropic
             messages = self._build_messages(message, conversation_history)
             
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=4000,
-                temperature=0.7,
-                messages=messages
-            )
-            
-            response_time = time.time() - start_time
+            cache_key = self._cache_key(messages)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
             
-            # Extraer texto de la respuesta
-            if response.content and len(response.content) > 0:
-                answer = response.content[0].text.strip()
+            response = self.client.messages.create(**self._request_params(messages))
+            return self._process_response(response, cache_key)
                 
-                return answer if answer else "🤔 Claude no generó una respuesta clara."
-            else:
-                return "❌ No se recibió respuesta válida de Claude."
+        except Exception as e:
+            return self._error_message(e)
+    
+    async def asend_message(self, message: str, conversation_history: List[Dict] = None) -> str:
+        """
+        Versión async de send_message: no bloquea el event loop durante la llamada a la API
+        
+        Args:
+            message: Mensaje del usuario
+            conversation_history: Historial de conversación
+            
+        Returns:
+            Respuesta del modelo
+        """
+        try:
+            messages = self._build_messages(message, conversation_history)
+            
+            cache_key = self._cache_key(messages)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+            
+            response = await self.aclient.messages.create(**self._request_params(messages))
+            return self._process_response(response, cache_key)
                 
-        except anthropic.APIError as e:
+        except Exception as e:
+            return self._error_message(e)
+
+    async def astream_message(self, message: str, conversation_history: List[Dict] = None,
+                              on_text: Callable[[str], None] = None) -> str:
+        """
+        Versión en streaming de asend_message: cada fragmento de texto se entrega a on_text
+        en cuanto llega, sin esperar a que Claude termine de generar
+
+        Args:
+            message: Mensaje del usuario
+            conversation_history: Historial de conversación
+            on_text: Función llamada con cada fragmento de texto recibido
+
+        Returns:
+            Respuesta completa del modelo
+        """
+        try:
+            messages = self._build_messages(message, conversation_history)
+
+            cache_key = self._cache_key(messages)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                if on_text:
+                    on_text(cached)
+                return cached
+
+            async with self.aclient.messages.stream(**self._request_params(messages)) as stream:
+                async for text in stream.text_stream:
+                    if on_text:
+                        on_text(text)
+                response = await stream.get_final_message()
+            return self._process_response(response, cache_key)
+
+        except Exception as e:
+            return self._error_message(e)
+
+    def _request_params(self, messages: List[Dict]) -> Dict:
+        """Parámetros comunes para messages.create"""
+        return {
+            "model": self.model_name,
+            "max_tokens": 4000,
+            "temperature": self.temperature,
+            "messages": messages
+        }
+    
+    def _process_response(self, response, cache_key: str) -> str:
+        """Extrae el texto de la respuesta, registra el uso de tokens y la guarda en caché"""
+        # Uso de tokens de la última llamada, incluidos los leídos/escritos en caché
+        usage = response.usage
+        self.last_usage = {
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0
+        }
+        logger.info("ANTHROPIC_USAGE | Input: %d | Output: %d | Cache read: %d | Cache creation: %d",
+                    self.last_usage["input_tokens"], self.last_usage["output_tokens"],
+                    self.last_usage["cache_read_input_tokens"], self.last_usage["cache_creation_input_tokens"])
+        
+        # Extraer texto de la respuesta
+        if response.content and len(response.content) > 0:
+            answer = response.content[0].text.strip()
+            
+            if answer:
+                self._cache_put(cache_key, answer)
+                self._remember_tokens(answer, usage.output_tokens)
+                return answer
+            return "🤔 Claude no generó una respuesta clara."
+        else:
+            return "❌ No se recibió respuesta válida de Claude."
+    
+    def _error_message(self, e: Exception) -> str:
+        """Convierte una excepción de la API en un mensaje para el usuario"""
+        if isinstance(e, anthropic.APIError):
             if "rate_limit" in str(e).lower():
                 return "❌ Límite de tasa alcanzado. Espera un momento antes de intentar de nuevo."
             elif "authentication" in str(e).lower():
                 return "❌ Error de autenticación. Verifica tu clave API de Anthropic."
             else:
                 return f"❌ Error de API de Anthropic: {str(e)}"
-                
-        except Exception as e:
-            return f"❌ Error inesperado: {str(e)}"
+        return f"❌ Error inesperado: {str(e)}"
+    
+    def _cache_key(self, messages: List[Dict]) -> str:
+        """Genera la clave de caché para una petición"""
+        return ResponseCache.make_key({"m": self.model_name, "t": self.temperature, "msgs": messages})
+    
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Busca una respuesta en caché; un acierto no llama a la API, así que no hay uso de tokens"""
+        answer = self._response_cache.get(key)
+        if answer is not None:
+            self.last_usage = {}
+        return answer
+    
+    def _cache_put(self, key: str, answer: str) -> None:
+        """Guarda una respuesta: sin vencimiento con temperatura 0, si no solo por cache_ttl segundos"""
+        ttl = None if self.temperature == 0 else self.cache_ttl
+        self._response_cache.put(key, answer, ttl)
     
     def _build_messages(self, message: str, history: List[Dict] = None) -> List[Dict]:
         """
@@ -117,6 +267,15 @@ class AnthropicClient:
                         "role": msg["role"],
                         "content": msg["content"]
                     })
+            
+            # Marcar el final del historial como prefijo cacheable (prompt caching de Anthropic):
+            # en el siguiente turno solo se procesa lo nuevo
+            if messages:
+                messages[-1]["content"] = [{
+                    "type": "text",
+                    "text": messages[-1]["content"],
+                    "cache_control": {"type": "ephemeral"}
+                }]
         
         # Agregar mensaje actual
         messages.append({
@@ -128,18 +287,33 @@ class AnthropicClient:
     
     def estimate_tokens(self, text: str) -> int:
         """
-        Estima el número de tokens en un texto
-        Aproximación para modelos Claude: 1 token ≈ 3-4 caracteres
+        Estima el número de tokens de un texto sin llamar a la API
+        Si el texto es una respuesta ya recibida usa su usage.output_tokens exacto;
+        si no, aproxima 1 token ≈ 3-4 caracteres (la aproximación no se guarda, así no
+        tapa un conteo exacto que llegue después)
         """
+        key = hashlib.sha256(text.encode('utf-8')).digest()
+        tokens = self._token_counts.get(key)
+        if tokens is not None:
+            self._token_counts.move_to_end(key)
+            return tokens
         return len(text) // 3
     
+    def _remember_tokens(self, text: str, tokens: int) -> None:
+        """Guarda el conteo exacto de tokens de un texto, descartando el menos usado si está lleno"""
+        key = hashlib.sha256(text.encode('utf-8')).digest()
+        self._token_counts[key] = tokens
+        self._token_counts.move_to_end(key)
+        if len(self._token_counts) > self.token_cache_size:
+            self._token_counts.popitem(last=False)
+    
     def get_model_info(self) -> Dict:
         """Obtiene información del modelo actual"""
         return {
             "model_name": self.model_name,
             "provider": "Anthropic",
             "max_tokens": 4000,
-            "temperature": 0.7
+            "temperature": self.temperature
         }
     
     def list_available_models(self) -> List[str]:
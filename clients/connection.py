@@ -1,18 +1,136 @@
 import asyncio
+import collections
+import itertools
 import json
+import logging
 import subprocess
 from pathlib import Path
 import sys
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def _dumps(value) -> bytes:
+    """Serializa un valor como JSON compacto (sin salto de línea)"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+# Hijo del logger del chatbot: hereda sus handlers (archivo y consola para WARNING+)
+logger = logging.getLogger("MCPChatbot.connection")
+
+def set_uvloop() -> bool:
+    """
+    Usa uvloop como event loop de asyncio si está instalado (no existe en Windows)
+    
+    Returns:
+        True si se activó uvloop
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+# Mensajes constantes ya codificados: solo cambian el id y el nombre del cliente
+_INITIALIZE_TEMPLATE = (
+    b'{"jsonrpc":"2.0","id":%d,"method":"initialize","params":{'
+    b'"protocolVersion":"2024-11-05",'
+    b'"capabilities":{"roots":{"listChanged":true},"sampling":{}},'
+    b'"clientInfo":{"name":%b,"version":"1.0.0"}}}\n'
+)
+_INITIALIZED_NOTIFICATION = b'{"jsonrpc":"2.0","method":"notifications/initialized"}\n'
+_TOOLS_LIST_TEMPLATE = b'{"jsonrpc":"2.0","id":%d,"method":"tools/list"}\n'
+# Solo el nombre y los argumentos se serializan en cada llamada
+_TOOLS_CALL_TEMPLATE = (
+    b'{"jsonrpc":"2.0","id":%d,"method":"tools/call",'
+    b'"params":{"name":%b,"arguments":%b}}\n'
+)
+
+# Respuesta a roots/list: la carpeta permitida no cambia durante la ejecución
+_ROOTS_URI = str(Path(__file__).parent)
+_ROOTS_RESPONSE_TEMPLATE = (
+    b'{"jsonrpc":"2.0","id":%b,"result":{"roots":[{"uri":'
+    # '%' escapado: la ruta del proyecto puede contenerlo y la plantilla se llena con %
+    + json.dumps(_ROOTS_URI).encode().replace(b"%", b"%%")
+    + b',"name":"LLM_PROYECTO1"}]}}\n'
+)
+
+# MCP por stdio usa un mensaje JSON por línea: el límite de StreamReader (64 KiB por defecto)
+# es el tamaño máximo de una respuesta, así que se sube para resultados grandes
+STREAM_LIMIT = 16 * 1024 * 1024
+
+# Buffer del pipe en el kernel (Linux): con 1 MiB una respuesta grande cabe en pocas lecturas
+PIPE_SIZE = 1024 * 1024
+_F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+
+def _enlarge_pipe(stream) -> None:
+    """Agranda el buffer del pipe de un stream del subproceso (solo Linux)"""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return
+    transport = getattr(stream, "_transport", None)
+    pipe = transport.get_extra_info("pipe") if transport is not None else None
+    if pipe is None:
+        return
+    try:
+        fcntl.fcntl(pipe.fileno(), _F_SETPIPE_SZ, PIPE_SIZE)
+    except OSError:
+        # Por encima de /proc/sys/fs/pipe-max-size: se queda con el tamaño por defecto
+        pass
+
+
+# Segundos máximos para enviar una request y recibir su respuesta
+REQUEST_TIMEOUT = 10.0
+
+# Líneas de stderr del servidor que se conservan para reportar un cierre inesperado
+STDERR_TAIL_LINES = 50
+
+
 class Client:
     """Cliente para interactuar con el  MCP Server"""
     
-    def __init__(self):
+    def __init__(self, max_concurrent_requests: int = 16):
         self.server_process = None
         self.is_connected = False
-        self.request_id = 1
+        self._request_ids = itertools.count(1)
+        
+        # Respuestas pendientes: id de la request → Future que resuelve el lector
+        self._pending = {}
+        self._reader_task = None
+        
+        # stderr del servidor: se vacía siempre para que el pipe no se llene y bloquee al
+        # servidor; se guardan las últimas líneas para diagnosticar un cierre inesperado
+        self._stderr_task = None
+        self._stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        
+        # Mensajes salientes del mismo tick del loop: se envían juntos con un writelines+drain
+        self._send_buffer = []
+        self._flush_task = None
+        self._write_lock = None
+        
+        # Herramientas del servidor; se invalida con notifications/tools/list_changed
+        self._tools_cache = None
+        
+        # Solicitudes del servidor (roots/list, sampling...) atendidas en paralelo, con límite
+        self.max_concurrent_requests = max_concurrent_requests
+        self._server_request_sem = None
+        self._server_request_tasks = set()
     
     async def start_server(self, server_name, *args: str):
         """Inicia el servidor """
@@ -21,191 +139,246 @@ class Client:
             if server_name not in ("git", "filesystem", "remote"):
                 server_path = Path(args[-1])
                 if not server_path.exists():
-                    print(f"❌ Servidor no encontrado: {server_path}")
+                    logger.error("❌ Servidor no encontrado: %s", server_path)
                     return False
             
+            self._tools_cache = None
+            # Lock y semáforo se crean dentro del loop que los usa (en 3.9 quedan atados al
+            # loop activo al construirlos, y el cliente se crea antes de asyncio.run)
+            self._write_lock = asyncio.Lock()
+            self._server_request_sem = asyncio.Semaphore(self.max_concurrent_requests)
             self.server_process = await asyncio.create_subprocess_exec(
                 *args,
                 stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                limit=STREAM_LIMIT
             )
+            _enlarge_pipe(self.server_process.stdout)
             
-            # Esperar un momento para que el servidor se inicie
-            await asyncio.sleep(1)
-            
-            # Verificar si el proceso sigue ejecutándose
-            if self.server_process.returncode is not None:
-                stderr_output = await self.server_process.stderr.read()
-                print(f"❌ El servidor se cerró inmediatamente: {stderr_output.decode()}")
-                return False
+            # Un único lector para toda la vida del proceso
+            self._reader_task = asyncio.create_task(self._reader_loop())
+            self._stderr_tail.clear()
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
             
-            # Inicializar el servidor MCP
+            # Inicializar el servidor MCP sin espera fija: la respuesta a initialize
+            # es la señal de que el servidor está listo
             if await self._initialize_mcp(server_name):
                 self.is_connected = True
                 print(f"✅ {server_name} Server conectado y listo")
                 return True
-            else:
-                print("❌ Falló la inicialización del servidor MCP")
+            
+            # Verificar si el proceso se cerró al arrancar
+            try:
+                await asyncio.wait_for(self.server_process.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            if self.server_process.returncode is not None:
+                await asyncio.wait({self._stderr_task}, timeout=1.0)
+                logger.error("❌ El servidor se cerró inmediatamente: %s", "\n".join(self._stderr_tail))
                 return False
+            
+            logger.error("❌ Falló la inicialización del servidor MCP")
+            return False
                 
         except Exception as e:
-            print(f"❌ Error iniciando  Server: {e}")
+            logger.error("❌ Error iniciando  Server: %s", e)
             return False
     
     async def _initialize_mcp(self, server_name) -> bool:
         """Inicializa la conexión MCP con el servidor"""
         try:
             # 1. Enviar mensaje de inicialización
-            init_message = {
-                "jsonrpc": "2.0",
-                "id": self._get_request_id(),
-                "method": "initialize",
-                "params": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {
-                        "roots": {
-                            "listChanged": True
-                        },
-                        "sampling": {}
-                    },
-                    "clientInfo": {
-                        "name": f"{server_name}-client",
-                        "version": "1.0.0"
-                    }
-                }
-            }
-            
-            response = await self._send_message(init_message)
+            request_id = self._get_request_id()
+            client_name = json.dumps(f"{server_name}-client").encode()
+            response = await self._send_request(request_id, _INITIALIZE_TEMPLATE % (request_id, client_name))
             if not response or "error" in response:
-                print(f"❌ Error en inicialización: {response.get('error') if response else 'Sin respuesta'}")
+                logger.error("❌ Error en inicialización: %s", response.get('error') if response else 'Sin respuesta')
                 return False
             
-            # 2. Enviar notificación de inicializado
-            initialized_notification = {
-                "jsonrpc": "2.0",
-                "method": "notifications/initialized",
-            }
-            
-            # Las notificaciones no esperan respuesta
-            await self._send_notification(initialized_notification)
+            # 2. Enviar notificación de inicializado (no espera respuesta)
+            await self._send_notification(_INITIALIZED_NOTIFICATION)
             
             return True
             
         except Exception as e:
-            print(f"❌ Error en inicialización MCP: {e}")
+            logger.error("❌ Error en inicialización MCP: %s", e)
             return False
     
-    async def _send_message(self, message: dict) -> dict:
-        """Envía un mensaje y espera respuesta"""
+    async def _send_request(self, request_id: int, data: bytes) -> dict:
+        """Envía una request ya codificada y espera la respuesta con ese ID"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
         try:
-            msg_str = json.dumps(message) + "\n"
-            
-            self.server_process.stdin.write(msg_str.encode())
-            await self.server_process.stdin.drain()
-
-            # Leer múltiples líneas hasta encontrar la respuesta correcta
-            max_attempts = 5
-            for attempt in range(max_attempts):
-                line = await asyncio.wait_for(self.server_process.stdout.readline(), timeout=10.0)
-                if not line:
-                    print("❌ No se recibió respuesta")
-                    return None
-                    
-                response = json.loads(line.decode().strip())
-                
-                # Si es una solicitud del servidor (como roots/list), responder y continuar
-                if "method" in response and "id" in response:
-                    await self._handle_server_request(response)
-                    continue
-                    
-                # Si es la respuesta a nuestro mensaje (tiene el mismo ID)
-                if "id" in response and response["id"] == message.get("id"):
-                    return response
-                    
-                # Si es una respuesta sin ID específico pero tiene "result"
-                if "result" in response or "error" in response:
-                    return response
-            
-            print(f"❌ No se encontró respuesta válida después de {max_attempts} intentos")
-            return None
+            # Un solo plazo para toda la request: escribir en stdin (drain incluido) y recibir la respuesta
+            response = await asyncio.wait_for(self._exchange(data, future), REQUEST_TIMEOUT)
+            if response is None:
+                logger.error("❌ No se recibió respuesta")
+            return response
             
         except asyncio.TimeoutError:
-            print("❌ Timeout esperando respuesta")
-            return None
-        except json.JSONDecodeError as e:
-            print(f"❌ Error decodificando JSON: {e}")
+            logger.error("❌ Timeout esperando respuesta")
             return None
         except Exception as e:
-            print(f"❌ Error enviando mensaje: {e}")
+            logger.error("❌ Error enviando mensaje: %s", e)
             return None
+        finally:
+            future.cancel()
+            self._pending.pop(request_id, None)
     
-    async def _send_notification(self, notification: dict):
-        """Envía una notificación (no espera respuesta)"""
+    async def _exchange(self, data: bytes, future: asyncio.Future) -> dict:
+        """Escribe la request y espera a que el lector entregue su respuesta"""
+        await self._write(data)
+        # El lector entrega la respuesta con este ID (o None si el servidor se cerró)
+        return await future
+    
+    async def _send_notification(self, notification: bytes):
+        """Envía una notificación ya codificada (no espera respuesta)"""
         try:
-            message_str = json.dumps(notification) + "\n"
+            await self._write(notification)
             
-            self.server_process.stdin.write(message_str.encode())
+        except Exception as e:
+            logger.error("❌ Error enviando notificación: %s", e)
+    
+    async def _write(self, data: bytes):
+        """Encola un mensaje para stdin y espera a que salga su lote"""
+        self._send_buffer.append(data)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_writes())
+            self._flush_task.add_done_callback(self._flush_done)
+        # shield: si quien espera se cancela, el lote se escribe igual para los demás
+        await asyncio.shield(self._flush_task)
+    
+    @staticmethod
+    def _flush_done(task: asyncio.Task):
+        """Recoge el error de un lote cuyos remitentes ya vencieron (servidor caído o que no lee)"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Error escribiendo en stdin del servidor: %r", task.exception())
+    
+    async def _flush_writes(self):
+        """Escribe en un solo writelines+drain todos los mensajes encolados en este tick"""
+        # Ceder una vez para que las demás coroutines listas encolen sus mensajes
+        await asyncio.sleep(0)
+        batch, self._send_buffer = self._send_buffer, []
+        self._flush_task = None
+        
+        # El lock mantiene el orden entre lotes y evita drains concurrentes sobre el mismo pipe
+        async with self._write_lock:
+            self.server_process.stdin.writelines(batch)
             await self.server_process.stdin.drain()
-            
+    
+    async def _reader_loop(self):
+        """Lee todas las líneas del servidor y entrega cada respuesta a quien la espera"""
+        stdout = self.server_process.stdout
+        try:
+            while True:
+                line = await stdout.readline()
+                if not line:
+                    break
+                
+                try:
+                    message = _loads(line)
+                except ValueError as e:  # JSON inválido o bytes que no son UTF-8 (json y orjson)
+                    logger.error("❌ Error decodificando JSON: %s", e)
+                    continue
+                
+                # Un print() suelto o un lote JSON-RPC no deben tumbar el lector
+                if not isinstance(message, dict):
+                    logger.warning("⚠️ Mensaje del servidor ignorado (no es un objeto JSON): %r", line[:200])
+                    continue
+                
+                # Solicitud del servidor (como roots/list): se atiende aparte
+                if "method" in message:
+                    if "id" in message:
+                        self._spawn_server_request(message)
+                    else:
+                        self._handle_server_notification(message)
+                    continue
+                
+                # Respuesta a una de nuestras requests
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+                    
         except Exception as e:
-            print(f"❌ Error enviando notificación: {e}")
+            logger.error("❌ Error leyendo del servidor: %s", e)
+        finally:
+            # El servidor cerró su salida: ninguna request pendiente va a recibir respuesta,
+            # y las siguientes llamadas fallan al instante en vez de esperar el timeout
+            self.is_connected = False
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self._pending.clear()
+    
+    async def _drain_stderr(self):
+        """Lee el stderr del servidor continuamente, guardando solo las últimas líneas"""
+        stderr = self.server_process.stderr
+        try:
+            while True:
+                line = await stderr.readline()
+                if not line:
+                    break
+                line = line.decode(errors="replace").rstrip()
+                self._stderr_tail.append(line)
+                logger.debug("[stderr] %s", line)
+        except Exception as e:
+            logger.debug("Error leyendo stderr del servidor: %s", e)
     
     def _get_request_id(self) -> int:
         """Genera un ID único para cada request"""
-        request_id = self.request_id
-        self.request_id += 1
-        return request_id
+        return next(self._request_ids)
+    
+    def _spawn_server_request(self, request):
+        """Atiende una solicitud del servidor en una tarea aparte para no frenar la lectura"""
+        task = asyncio.create_task(self._bounded_server_request(request))
+        self._server_request_tasks.add(task)
+        task.add_done_callback(self._server_request_tasks.discard)
+    
+    async def _bounded_server_request(self, request):
+        """Limita cuántas solicitudes del servidor se atienden a la vez"""
+        async with self._server_request_sem:
+            await self._handle_server_request(request)
+    
+    def _handle_server_notification(self, notification):
+        """Maneja notificaciones del servidor (no llevan respuesta)"""
+        if notification.get("method") == "notifications/tools/list_changed":
+            self._tools_cache = None
     
     async def _handle_server_request(self, request):
         """Maneja solicitudes del servidor (como roots/list)"""
         try:
             if request.get("method") == "roots/list":
-                # Responder con la lista de roots permitidos
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request["id"],
-                    "result": {
-                        "roots": [
-                            {
-                                "uri": str(Path(__file__).parent),
-                                "name": "LLM_PROYECTO1"
-                            }
-                        ]
-                    }
-                }
-                
-                msg_str = json.dumps(response) + "\n"
-                self.server_process.stdin.write(msg_str.encode())
-                await self.server_process.stdin.drain()
+                # Responder con la lista de roots permitidos (el ID puede ser número o texto)
+                request_id = json.dumps(request["id"]).encode()
+                await self._write(_ROOTS_RESPONSE_TEMPLATE % request_id)
                 
         except Exception as e:
-            print(f"❌ Error manejando solicitud del servidor: {e}")
+            logger.error("❌ Error manejando solicitud del servidor: %s", e)
         
     async def list_tools(self) -> List[Dict]:
         """Lista las herramientas disponibles en el servidor"""
         if not self.is_connected:
-            print("❌  Server no está conectado")
+            logger.warning("❌  Server no está conectado")
             return []
         
+        if self._tools_cache is not None:
+            return self._tools_cache
+        
         try:
-            message = {
-                "jsonrpc": "2.0",
-                "id": self._get_request_id(),
-                "method": "tools/list"
-            }
-            
-            response = await self._send_message(message)
+            request_id = self._get_request_id()
+            response = await self._send_request(request_id, _TOOLS_LIST_TEMPLATE % request_id)
             
             if response and "result" in response:
                 tools = response["result"]["tools"]
+                self._tools_cache = tools
                 return tools
             else:
-                print(f"❌ Error listando herramientas: {response}")
+                logger.error("❌ Error listando herramientas: %s", response)
                 return []
                 
         except Exception as e:
-            print(f"❌ Error listando herramientas: {e}")
+            logger.error("❌ Error listando herramientas: %s", e)
             return []
     
     async def call_tool(self, tool_name: str, arguments: dict) -> str:
@@ -214,25 +387,16 @@ class Client:
             return "❌  Server no está conectado"
         
         try:
-            message = {
-                "jsonrpc": "2.0",
-                "id": self._get_request_id(),
-                "method": "tools/call",
-                "params": {
-                    "name": tool_name,
-                    "arguments": arguments
-                }
-            }
-            
-            response = await self._send_message(message)
+            request_id = self._get_request_id()
+            data = _TOOLS_CALL_TEMPLATE % (request_id, _dumps(tool_name), _dumps(arguments))
+            response = await self._send_request(request_id, data)
             
             if response and "result" in response:
-                # Extraer el contenido de la respuesta
-                content = response["result"]["content"]
-                if isinstance(content, list) and len(content) > 0:
-                    return content[0]["text"]
-                else:
-                    return str(content)
+                # Extraer el contenido de la respuesta: casi siempre es [{"type": "text", "text": ...}]
+                try:
+                    return response["result"]["content"][0]["text"]
+                except (KeyError, TypeError, IndexError):
+                    return str(response["result"]["content"])
             elif response and "error" in response:
                 return f"❌ Error: {response['error']['message']}"
             else:
@@ -243,16 +407,31 @@ class Client:
 
     async def stop_server(self):
         """Detiene el servidor"""
+        # Si el lector ya terminó, el servidor cerró su salida (proceso caído o pipe roto)
+        server_gone = self._reader_task is not None and self._reader_task.done()
+        
+        for task in self._server_request_tasks:
+            task.cancel()
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._stderr_task:
+            self._stderr_task.cancel()
+        self.is_connected = False
+        
         if self.server_process and self.server_process.returncode is None:
             print("🛑 Deteniendo  Server...")
-            self.server_process.terminate()
             
-            try:
-                await asyncio.wait_for(self.server_process.wait(), timeout=5.0)
-            except asyncio.TimeoutError:
-                print("⚠️ Forzando cierre del servidor...")
+            if server_gone:
+                # No tiene sentido esperar un cierre ordenado
                 self.server_process.kill()
                 await self.server_process.wait()
+            else:
+                self.server_process.terminate()
+                try:
+                    await asyncio.wait_for(self.server_process.wait(), timeout=5.0)
+                except asyncio.TimeoutError:
+                    logger.warning("⚠️ Forzando cierre del servidor...")
+                    self.server_process.kill()
+                    await self.server_process.wait()
             
-            self.is_connected = False
             print("✅  Server detenido")
\ No newline at end of file
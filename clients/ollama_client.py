@@ -1,21 +1,39 @@
 # src/chatbot/ollama_client.py
+import asyncio
 import requests
 import json
 import time
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
+
+from clients.response_cache import ResponseCache
 
 class OllamaClient:
-    def __init__(self, model_name: str = "llama3.2:3b", base_url: str = "http://localhost:11434"):
+    def __init__(self, model_name: str = "llama3.2:3b", base_url: str = "http://localhost:11434",
+                 cache_size: int = 128, cache_ttl: float = 300.0):
         """
         Cliente para interactuar con Ollama local
         
         Args:
             model_name: Nombre del modelo a usar
             base_url: URL base de Ollama
+            cache_size: Máximo de respuestas en caché (0 para desactivarla)
+            cache_ttl: Segundos que vale una respuesta en caché si la temperatura no es 0
         """
         self.model_name = model_name
         self.base_url = base_url
         self.session = requests.Session()
+        self.options = {
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "num_predict": 2000,  # máximo tokens de salida
+            "repeat_penalty": 1.1,
+            "top_k": 40
+        }
+        
+        # Caché LRU de respuestas exactas: mismo prompt → misma respuesta sin llamar al modelo
+        # (con muestreo aleatorio solo durante cache_ttl segundos)
+        self.cache_ttl = cache_ttl
+        self._response_cache = ResponseCache(cache_size)
         
         # Verificar conexión al inicializar
         if not self.check_connection():
@@ -49,6 +67,11 @@ class OllamaClient:
         # Construir prompt con contexto
         prompt = self._build_prompt(message, conversation_history)
         
+        cache_key = self._cache_key(prompt)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             start_time = time.time()
             
@@ -58,13 +81,7 @@ class OllamaClient:
                     "model": self.model_name,
                     "prompt": prompt,
                     "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "num_predict": 2000,  # máximo tokens de salida
-                        "repeat_penalty": 1.1,
-                        "top_k": 40
-                    }
+                    "options": self.options
                 },
                 timeout=1200  # timeout más largo para modelos locales
             )
@@ -79,7 +96,10 @@ class OllamaClient:
                 if response_time > 10:
                     print(f"⚠️  Respuesta lenta: {response_time:.1f}s")
                 
-                return answer if answer else "🤔 El modelo no generó una respuesta clara."
+                if answer:
+                    self._cache_put(cache_key, answer)
+                    return answer
+                return "🤔 El modelo no generó una respuesta clara."
                 
             else:
                 return f"❌ Error del servidor Ollama: {response.status_code} - {response.text}"
@@ -91,6 +111,115 @@ class OllamaClient:
         except Exception as e:
             return f"❌ Error inesperado: {str(e)}"
     
+    async def asend_message(self, message: str, conversation_history: List[Dict] = None) -> str:
+        """
+        Versión async de send_message: la petición HTTP corre en un hilo y no bloquea el event loop
+        
+        Args:
+            message: Mensaje del usuario
+            conversation_history: Historial de conversación
+            
+        Returns:
+            Respuesta del modelo
+        """
+        return await asyncio.to_thread(self.send_message, message, conversation_history)
+
+    def stream_message(self, message: str, conversation_history: List[Dict] = None,
+                       on_text: Callable[[str], None] = None) -> str:
+        """
+        Envía mensaje al modelo con "stream": True y entrega cada fragmento a on_text
+        en cuanto Ollama lo genera
+
+        Args:
+            message: Mensaje del usuario
+            conversation_history: Historial de conversación
+            on_text: Función llamada con cada fragmento de texto recibido
+
+        Returns:
+            Respuesta completa del modelo
+        """
+        prompt = self._build_prompt(message, conversation_history)
+
+        cache_key = self._cache_key(prompt)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            if on_text:
+                on_text(cached)
+            return cached
+
+        try:
+            # with: la conexión vuelve al pool aunque se salga antes (error, "done" o excepción)
+            with self.session.post(
+                f"{self.base_url}/api/generate",
+                json={
+                    "model": self.model_name,
+                    "prompt": prompt,
+                    "stream": True,
+                    "options": self.options
+                },
+                stream=True,
+                timeout=1200
+            ) as response:
+                if response.status_code != 200:
+                    return f"❌ Error del servidor Ollama: {response.status_code} - {response.text}"
+
+                # Cada línea es un JSON con un fragmento en "response"; la última trae "done": true
+                chunks = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        return f"❌ Error del servidor Ollama: {data['error']}"
+                    text = data.get("response", "")
+                    if text:
+                        chunks.append(text)
+                        if on_text:
+                            on_text(text)
+                    if data.get("done"):
+                        break
+
+            answer = "".join(chunks).strip()
+            if answer:
+                self._cache_put(cache_key, answer)
+                return answer
+            return "🤔 El modelo no generó una respuesta clara."
+
+        except requests.exceptions.ConnectionError:
+            return "❌ No se puede conectar a Ollama. ¿Está ejecutándose? (ollama serve)"
+        except requests.exceptions.Timeout:
+            return "❌ Timeout: El modelo está tardando demasiado. Intenta con un mensaje más corto."
+        except Exception as e:
+            return f"❌ Error inesperado: {str(e)}"
+
+    async def astream_message(self, message: str, conversation_history: List[Dict] = None,
+                              on_text: Callable[[str], None] = None) -> str:
+        """
+        Versión async de stream_message: la lectura del stream corre en un hilo
+
+        Args:
+            message: Mensaje del usuario
+            conversation_history: Historial de conversación
+            on_text: Función llamada con cada fragmento de texto recibido
+
+        Returns:
+            Respuesta completa del modelo
+        """
+        return await asyncio.to_thread(self.stream_message, message, conversation_history, on_text)
+
+    def _cache_key(self, prompt: str) -> str:
+        """Genera la clave de caché para un prompt"""
+        return ResponseCache.make_key({"m": self.model_name, "o": self.options, "p": prompt})
+    
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Busca una respuesta en caché"""
+        return self._response_cache.get(key)
+    
+    def _cache_put(self, key: str, answer: str) -> None:
+        """Guarda una respuesta: sin vencimiento con temperatura 0, si no solo por cache_ttl segundos"""
+        ttl = None if self.options["temperature"] == 0 else self.cache_ttl
+        self._response_cache.put(key, answer, ttl)
+    
     def _build_prompt(self, message: str, history: List[Dict] = None) -> str:
         """
         Construye prompt optimizado con contexto de conversación
@@ -102,8 +231,8 @@ class OllamaClient:
         Returns:
             Prompt formateado para el modelo
         """
-        # Prompt base que define el comportamiento
-        prompt = "\n"
+        # Prompt base que define el comportamiento; las partes se unen al final en una sola copia
+        parts = ["\n"]
         
         if history:
             # Incluir solo los últimos mensajes para no exceder el contexto
@@ -111,13 +240,13 @@ class OllamaClient:
             
             for msg in recent_history:
                 if msg["role"] == "user":
-                    prompt += f"Usuario: {msg['content']}\n"
+                    parts.append(f"Usuario: {msg['content']}\n")
                 elif msg["role"] == "assistant":
-                    prompt += f"Asistente: {msg['content']}\n"
+                    parts.append(f"Asistente: {msg['content']}\n")
         
-        prompt += f"Usuario: {message}\nAsistente:"
+        parts.append(f"Usuario: {message}\nAsistente:")
         
-        return prompt
+        return "".join(parts)
     
     def check_connection(self) -> bool:
         """Verifica si Ollama está disponible"""
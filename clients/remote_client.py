@@ -2,8 +2,22 @@ import asyncio
 import aiohttp
 import httpx
 import json
+import logging
 from typing import Dict, List, Optional
 
+# Hijo del logger del chatbot: hereda sus handlers (archivo y consola para WARNING+)
+logger = logging.getLogger("MCPChatbot.remote")
+
+# tool_name → (método HTTP, endpoint, parámetros válidos); sin parámetros listados se aceptan todos
+_ENDPOINTS = {
+    "health_check": ("GET", "/health", frozenset()),
+    "get_inspirational_quote": ("GET", "/api/quote", frozenset(("category", "mood", "time_based"))),
+    "get_sleep_hygiene_tip": ("GET", "/api/tip", frozenset()),
+    "search_sleep_quotes": ("GET", "/api/search/{query}", frozenset(("query", "limit"))),
+    "get_daily_sleep_wisdom": ("GET", "/api/wisdom", frozenset(("include_tip",))),
+    "mcp_call": ("POST", "/mcp", frozenset())
+}
+
 class RemoteSleepQuotesClient:
     """Cliente para conectarse a servidores MCP remotos via HTTP"""
     
@@ -25,11 +39,11 @@ class RemoteSleepQuotesClient:
                 print(f"✅ {server_name} Server remoto conectado y listo")
                 return True
             else:
-                print("❌ El servidor remoto no está disponible")
+                logger.error("❌ El servidor remoto no está disponible")
                 return False
                 
         except Exception as e:
-            print(f"❌ Error conectando al servidor remoto: {e}")
+            logger.error("❌ Error conectando al servidor remoto: %s", e)
             return False
     
     async def _check_server_health(self) -> bool:
@@ -40,13 +54,13 @@ class RemoteSleepQuotesClient:
                     await response.json()
                     return True
         except Exception as e:
-            print(f"❌ Error verificando salud del servidor: {e}")
+            logger.error("❌ Error verificando salud del servidor: %s", e)
         return False
     
     async def list_tools(self) -> List[Dict]:
         """Lista las herramientas disponibles basadas en los endpoints REST"""
         if not self.is_connected:
-            print("❌ Servidor remoto no está conectado")
+            logger.warning("❌ Servidor remoto no está conectado")
             return []
         
         try:
@@ -155,7 +169,7 @@ class RemoteSleepQuotesClient:
             return tools
             
         except Exception as e:
-            print(f"❌ Error listando herramientas remotas: {e}")
+            logger.error("❌ Error listando herramientas remotas: %s", e)
             return []
     
     async def call_endpoint(self, tool_name: str, arguments: dict) -> str:
@@ -165,19 +179,11 @@ class RemoteSleepQuotesClient:
         
         try:
             # Mapear tool_name a endpoint y método HTTP
-            endpoint_mapping = {
-                "health_check": ("GET", "/health", {}),
-                "get_inspirational_quote": ("GET", "/api/quote", ["category", "mood", "time_based"]),
-                "get_sleep_hygiene_tip": ("GET", "/api/tip", {}),
-                "search_sleep_quotes": ("GET", "/api/search/{query}", ["query", "limit"]),
-                "get_daily_sleep_wisdom": ("GET", "/api/wisdom", ["include_tip"]),
-                "mcp_call": ("POST", "/mcp", {})
-            }
-            
-            if tool_name not in endpoint_mapping:
+            mapping = _ENDPOINTS.get(tool_name)
+            if mapping is None:
                 return f"❌ Herramienta desconocida: {tool_name}"
             
-            method, endpoint, valid_params = endpoint_mapping[tool_name]
+            method, endpoint, valid_params = mapping
             url = f"{self.base_url}{endpoint}"
             
             if method == "GET":
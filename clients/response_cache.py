@@ -0,0 +1,53 @@
+# src/chatbot/response_cache.py
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 128):
+        """
+        Caché LRU de respuestas exactas del LLM, con vencimiento opcional por entrada
+
+        Args:
+            maxsize: Máximo de respuestas guardadas (0 para desactivarla)
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(payload: Any) -> str:
+        """Genera la clave de caché de una petición (modelo, parámetros de muestreo y entrada)"""
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Busca una respuesta vigente y la marca como usada recientemente"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Guarda una respuesta, descartando la menos usada si la caché está llena
+
+        Args:
+            key: Clave generada con make_key
+            value: Respuesta a guardar
+            ttl: Segundos de validez (None = sin vencimiento, solo para muestreo determinista)
+        """
+        if self.maxsize <= 0:
+            return
+        expires = None if ttl is None else time.monotonic() + ttl
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
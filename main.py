@@ -9,24 +9,54 @@ from typing import Dict
 from dotenv import load_dotenv
 
 from clients.ollama_client import OllamaClient
-from clients.connection import Client
+from clients.connection import Client, set_uvloop
 from clients.remote_client import RemoteSleepQuotesClient
 
 from tools.session_manager import SessionManager
-from tools.logger import InteractionLogger
+from tools.logger import InteractionLogger, Turn
+from tools.stream_printer import StreamPrinter
+from tools.console_input import ainput
+
+
+# Variables de entorno (.env) cargadas una sola vez al importar
+load_dotenv()
+
+_TS_FMT = "%Y%m%d_%H%M%S"
+
+# Rutas de los servidores MCP, calculadas una sola vez
+_PROJECT_DIR = str(Path(__file__).parent)
+_LOCAL_SERVERS_DIR = Path(__file__).parent.parent / "servidores locales mcp"
+
+_BANNER = "=" * 60
+
+_WELCOME_TEXT = f"""
+{_BANNER}
+CHATBOT MCP LOCAL - ¡Bienvenido!
+Usando modelo local con Ollama (100% privado)
+{_BANNER}
+💬 Puedes hacer preguntas normales o usar comandos especiales:
+
+COMANDOS ESPECIALES:
+  /help         - Mostrar esta ayuda
+  /log          - Mostrar log de interacciones
+  /stats        - Mostrar estadísticas de la sesión
+  /context      - Mostrar resumen del contexto actual
+  /clear        - Limpiar contexto de conversación
+  /save         - Guardar sesión actual
+  /quit         - Salir del chatbot
+
+{_BANNER}"""
 
 
 class MCPChatbot:
     def __init__(self):
         """Inicializa el chatbot con todos sus componentes"""
-        load_dotenv()
-        
         try:
             self.ollama = OllamaClient()
             self.session = SessionManager()
             self.logger = InteractionLogger()
 
-            self.session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            self.session_id = f"session_{datetime.now().strftime(_TS_FMT)}"
 
             self.clients = {
                 "git": Client(),
@@ -37,6 +67,17 @@ class MCPChatbot:
                 "videogames": Client(),
                 "movies": Client()
             }
+
+            # Comandos especiales: nombre → handler
+            self._commands = {
+                "/help": self.show_welcome_message,
+                "/log": self.logger.show_interaction_log,
+                "/stats": self._show_stats,
+                "/context": self.session.show_context_summary,
+                "/clear": self.session.clear_context,
+                "/save": self._save_session_command,
+                "/quit": lambda: None
+            }
             
             print("Inicializando chatbot MCP con Ollama...")
             print("✅ Conexión con Ollama establecida")
@@ -51,32 +92,32 @@ class MCPChatbot:
     
     async def initialize_servers(self):
         await self.clients["git"].start_server(
-            "git", sys.executable, "-m", "mcp_server_git", "--repository", str(Path(__file__).parent)
+            "git", sys.executable, "-m", "mcp_server_git", "--repository", _PROJECT_DIR
         )
         
         await self.clients["files"].start_server(
             "filesystem", r"C:\Program Files\nodejs\npx.cmd",
-            "-y", "@modelcontextprotocol/server-filesystem", str(Path(__file__).parent)
+            "-y", "@modelcontextprotocol/server-filesystem", _PROJECT_DIR
         )
 
         await self.clients["sleep_coach"].start_server(
             "sleep_coach", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/SleepCoachServer/sleep_coach.py")
+            str(_LOCAL_SERVERS_DIR / "SleepCoachServer/sleep_coach.py")
         )
 
         await self.clients["beauty"].start_server(
             "beauty", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/beauty-palette-server-local/beauty_server.py")
+            str(_LOCAL_SERVERS_DIR / "beauty-palette-server-local/beauty_server.py")
         )
 
         await self.clients["videogames"].start_server(
             "videogames", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/MCP_VIDEOGAMES_REC_INFO/server/mcp_server.py")
+            str(_LOCAL_SERVERS_DIR / "MCP_VIDEOGAMES_REC_INFO/server/mcp_server.py")
         )
 
         await self.clients["movies"].start_server(
             "movies", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/Movies_ChatBot/movie_server.py")
+            str(_LOCAL_SERVERS_DIR / "Movies_ChatBot/movie_server.py")
         )
 
         await self.clients["remote"].start_server()
@@ -84,14 +125,17 @@ class MCPChatbot:
         return
     
     async def servers_with_llm(self):
-        # Obtener herramientas de cada servidor MCP
-        sleep_tools = await self.clients["sleep_coach"].list_tools()
-        git_tools = await self.clients["git"].list_tools()
-        files_tools = await self.clients["files"].list_tools()
-        beauty_tools = await self.clients["beauty"].list_tools()
-        videogames_tools = await self.clients["videogames"].list_tools()
-        movies_tools = await self.clients["movies"].list_tools()
-        remote_tools = await self.clients["remote"].list_tools()
+        # Obtener herramientas de cada servidor MCP (en paralelo: cada uno tiene su propio canal)
+        (sleep_tools, git_tools, files_tools, beauty_tools,
+         videogames_tools, movies_tools, remote_tools) = await asyncio.gather(
+            self.clients["sleep_coach"].list_tools(),
+            self.clients["git"].list_tools(),
+            self.clients["files"].list_tools(),
+            self.clients["beauty"].list_tools(),
+            self.clients["videogames"].list_tools(),
+            self.clients["movies"].list_tools(),
+            self.clients["remote"].list_tools(),
+        )
 
         # Construir contexto para el LLM
         llm_context = f"""
@@ -154,7 +198,7 @@ class MCPChatbot:
         """
         try:
             # Enviar el contexto al LLM y registrar en la sesión
-            llm_response = self.ollama.send_message(llm_context)
+            llm_response = await self.ollama.asend_message(llm_context)
             self.session.add_message("user", llm_context)
         except Exception as e:
             print(f"❌ Error enviando contexto: {e}")
@@ -164,22 +208,7 @@ class MCPChatbot:
 
     def show_welcome_message(self):
         """Muestra mensaje de bienvenida y comandos disponibles"""
-        print("\n" + "="*60)
-        print("CHATBOT MCP LOCAL - ¡Bienvenido!")
-        print("Usando modelo local con Ollama (100% privado)")
-        print("="*60)
-        print("💬 Puedes hacer preguntas normales o usar comandos especiales:")
-        print()
-        print("COMANDOS ESPECIALES:")
-        print("  /help         - Mostrar esta ayuda")
-        print("  /log          - Mostrar log de interacciones")
-        print("  /stats        - Mostrar estadísticas de la sesión")
-        print("  /context      - Mostrar resumen del contexto actual")
-        print("  /clear        - Limpiar contexto de conversación")
-        print("  /save         - Guardar sesión actual")
-        print("  /quit         - Salir del chatbot")
-        print()
-        print("="*60)
+        print(_WELCOME_TEXT)
     
     async def process_special_command(self, command: str) -> bool:
         """
@@ -191,65 +220,53 @@ class MCPChatbot:
         Returns:
             True si era un comando especial, False si no
         """
-        command = command.lower().strip()
+        # Solo se normaliza el nombre del comando; el resto conserva mayúsculas
+        name, _, _ = command.strip().partition(" ")
+        handler = self._commands.get(name.lower())
+        if handler is None:
+            return False
         
-        if command == '/help':
-            self.show_welcome_message()
-            return True
-            
-        elif command == '/log':
-            self.logger.show_interaction_log()
-            return True
-            
-        elif command == '/stats':
-            stats = self.session.get_session_stats()
-            mcp_stats = self.logger.get_mcp_stats()
-            
-            print(f"\n📊 ESTADÍSTICAS DE SESIÓN:")
-            print(f"  Total mensajes: {stats['total_messages']}")
-            print(f"  Mensajes usuario: {stats['user_messages']}")
-            print(f"  Mensajes chatbot: {stats['assistant_messages']}")
-            print(f"   Duración: {stats['session_duration']}")
-            print(f"  Mensajes en contexto: {stats['messages_in_context']}")
-            print(f"\nESTADÍSTICAS MCP:")
-            print(f"  Interacciones totales: {mcp_stats['total_interactions']}")
-            print(f"  Tasa de éxito: {mcp_stats['success_rate']:.1f}%")
-            print(f"  Servidores usados: {', '.join(mcp_stats['servers_used']) if mcp_stats['servers_used'] else 'Ninguno'}")
-            
-            return True
-            
-        elif command == '/context':
-            self.session.show_context_summary()
-            return True
-            
-        elif command == '/clear':
-            self.session.clear_context()
-            return True
-            
-        elif command == '/save':
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"session_{timestamp}.json"
-            self.session.save_session(filename)
-            return True
-            
-        elif command == '/quit':
-            return True
+        result = handler()
+        if asyncio.iscoroutine(result):
+            await result
+        return True
+    
+    def _show_stats(self) -> None:
+        """Muestra estadísticas de la sesión y de uso de MCP"""
+        stats = self.session.get_session_stats()
+        mcp_stats = self.logger.get_mcp_stats()
         
-        return False
+        print(f"\n📊 ESTADÍSTICAS DE SESIÓN:")
+        print(f"  Total mensajes: {stats['total_messages']}")
+        print(f"  Mensajes usuario: {stats['user_messages']}")
+        print(f"  Mensajes chatbot: {stats['assistant_messages']}")
+        print(f"   Duración: {stats['session_duration']}")
+        print(f"  Mensajes en contexto: {stats['messages_in_context']}")
+        print(f"\nESTADÍSTICAS MCP:")
+        print(f"  Interacciones totales: {mcp_stats['total_interactions']}")
+        print(f"  Tasa de éxito: {mcp_stats['success_rate']:.1f}%")
+        print(f"  Servidores usados: {', '.join(mcp_stats['servers_used']) if mcp_stats['servers_used'] else 'Ninguno'}")
+    
+    async def _save_session_command(self) -> None:
+        """Guarda la sesión actual con un nombre basado en la fecha"""
+        filename = f"session_{datetime.now().strftime(_TS_FMT)}.json"
+        # Escribir el archivo en un hilo para no bloquear el event loop
+        await asyncio.to_thread(self.session.save_session, filename)
 
-    async def process_user_message(self, message: str) -> str:
+    async def process_user_message(self, message: str, on_text=None) -> str:
         """
         Procesa mensaje del usuario y genera respuesta
         
         Args:
             message: Mensaje del usuario
+            on_text: Función que recibe la respuesta del LLM en streaming (opcional)
             
         Returns:
             Respuesta del chatbot
         """
         context = self.session.get_context()
         # Preguntar al LLM qué hacer
-        llm_response = self.ollama.send_message(message, context)
+        llm_response = await self.ollama.astream_message(message, context, on_text)
 
         # Intentar interpretar como JSON
         try:
@@ -276,9 +293,6 @@ class MCPChatbot:
             # No era JSON → respuesta normal del LLM
             final_answer = llm_response
 
-        # Guardar respuesta en historial
-        self.session.add_message("assistant", final_answer)
-        
         return final_answer
     
     async def _async_run(self):
@@ -287,56 +301,54 @@ class MCPChatbot:
         await self.servers_with_llm()
 
         """Versión async del loop principal"""
-        while True:
-            # Obtener entrada del usuario
-            user_input = input(f"\n👤 Tú: ").strip()
+        try:
+            while True:
+                # Obtener entrada del usuario
+                user_input = (await ainput("\n👤 Tú: ")).strip()
             
-            # Verificar si es comando especial
-            if user_input.startswith('/'):
-                should_quit = await self.process_special_command(user_input)
-                if user_input.lower() == '/quit':
-                    break
-                if should_quit:
-                    continue
+                # Verificar si es comando especial
+                if user_input.startswith('/'):
+                    should_quit = await self.process_special_command(user_input)
+                    if user_input.lower() == '/quit':
+                        break
+                    if should_quit:
+                        continue
                 
-            # Verificar entrada vacía
-            if not user_input:
-                print("💭 Por favor ingresa un mensaje o usa /help para ver comandos")
-                continue
-            
-            # Registrar entrada del usuario
-            self.logger.log_user_input(user_input, self.session_id)
+                # Verificar entrada vacía
+                if not user_input:
+                    print("💭 Por favor ingresa un mensaje o usa /help para ver comandos")
+                    continue
             
-            # Procesar mensaje
-            print("🤔 Pensando...")
-            response = await self.process_user_message(user_input)
+                # Procesar mensaje
+                print("🤔 Pensando...")
+                printer = StreamPrinter()
+                response = await self.process_user_message(user_input, on_text=printer)
             
-            # Agregar al contexto
-            self.session.add_message("user", user_input)
-            self.session.add_message("assistant", response)
+                # El texto normal ya se mostró en vivo; las respuestas de herramientas se imprimen aquí
+                printer.finish(response)
             
-            # Registrar respuesta
-            estimated_tokens = self.ollama.estimate_tokens(response)
-            self.logger.log_anthropic_response(response, estimated_tokens, self.session_id)
+                # Agregar el turno completo al contexto (un solo recorte)
+                self.session.add_messages([("user", user_input), ("assistant", response)])
             
-            # Mostrar respuesta
-            print(f"\n🤖 Chatbot: {response}")
+                # Registrar el turno completo (solo encola; el hilo del logger escribe a disco)
+                estimated_tokens = self.ollama.estimate_tokens(response)
+                self.logger.log_turn(Turn(self.session_id, user_input, response, estimated_tokens))
+
+        finally:
+            # Cerrar todos los clientes al salir del loop
+            for client in self.clients:
+                await self.clients[client].stop_server()
+            print("¡Todos los servidores cerrados correctamente!")
 
     def run(self):
         """Ejecuta el loop principal del chatbot"""
         self.show_welcome_message()
         
         try:
-            # Iniciar loop asyncio si no está corriendo
-            try:
-                loop = asyncio.get_running_loop()
-            except RuntimeError:
-                # No hay loop corriendo, crear uno nuevo
-                asyncio.run(self._async_run())
-                return
-            
-            # Si ya hay un loop, usar run_until_complete
-            loop.run_until_complete(self._async_run())
+            # Un solo loop asyncio para toda la sesión (servidores, entrada y cierre);
+            # con uvloop si está instalado
+            set_uvloop()
+            asyncio.run(self._async_run())
                 
         except KeyboardInterrupt:
             print("\n\n🛑 Chatbot interrumpido por el usuario")
@@ -346,9 +358,10 @@ class MCPChatbot:
         finally:
             # Guardar sesión al salir
             self.session.save_session(f"{self.session_id}.json")
+            self.logger.close()
             print("Sesión guardada automáticamente")
             print("¡Hasta luego!")
 
 
 if __name__ == "__main__":
-    asyncio.run(MCPChatbot().run())
\ No newline at end of file
+    MCPChatbot().run()
\ No newline at end of file
@@ -7,24 +7,54 @@ from datetime import datetime
 from dotenv import load_dotenv
 
 from clients.anthropic_client import AnthropicClient
-from clients.connection import Client
+from clients.connection import Client, set_uvloop
 from clients.remote_client import RemoteSleepQuotesClient
 
 from tools.session_manager import SessionManager
-from tools.logger import InteractionLogger
+from tools.logger import InteractionLogger, Turn
+from tools.stream_printer import StreamPrinter
+from tools.console_input import ainput
+
+
+# Variables de entorno (.env) cargadas una sola vez al importar
+load_dotenv()
+
+_TS_FMT = "%Y%m%d_%H%M%S"
+
+# Rutas de los servidores MCP, calculadas una sola vez
+_PROJECT_DIR = str(Path(__file__).parent)
+_LOCAL_SERVERS_DIR = Path(__file__).parent.parent / "servidores locales mcp"
+
+_BANNER = "=" * 60
+
+_WELCOME_TEXT = f"""
+{_BANNER}
+CHATBOT MCP CON ANTHROPIC CLAUDE - ¡Bienvenido!
+Usando Claude API (inteligencia avanzada en la nube)
+{_BANNER}
+💬 Puedes hacer preguntas normales o usar comandos especiales:
+
+COMANDOS ESPECIALES:
+  /help         - Mostrar esta ayuda
+  /log          - Mostrar log de interacciones
+  /stats        - Mostrar estadísticas de la sesión
+  /context      - Mostrar resumen del contexto actual
+  /clear        - Limpiar contexto de conversación
+  /save         - Guardar sesión actual
+  /quit         - Salir del chatbot
+
+{_BANNER}"""
 
 
 class MCPChatbot:
     def __init__(self):
         """Inicializa el chatbot con todos sus componentes"""
-        load_dotenv()
-        
         try:
             self.claude = AnthropicClient()
             self.session = SessionManager()
             self.logger = InteractionLogger()
 
-            self.session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            self.session_id = f"session_{datetime.now().strftime(_TS_FMT)}"
 
             self.clients = {
                 "git": Client(),
@@ -35,6 +65,17 @@ class MCPChatbot:
                 "videogames": Client(),
                 "movies": Client()
             }
+
+            # Comandos especiales: nombre → handler
+            self._commands = {
+                "/help": self.show_welcome_message,
+                "/log": self.logger.show_interaction_log,
+                "/stats": self._show_stats,
+                "/context": self.session.show_context_summary,
+                "/clear": self.session.clear_context,
+                "/save": self._save_session_command,
+                "/quit": lambda: None
+            }
                 
         except Exception as e:
             print(f"❌ Error inicializando chatbot: {str(e)}")
@@ -42,32 +83,32 @@ class MCPChatbot:
     
     async def initialize_servers(self):
         await self.clients["git"].start_server(
-            "git", sys.executable, "-m", "mcp_server_git", "--repository", str(Path(__file__).parent)
+            "git", sys.executable, "-m", "mcp_server_git", "--repository", _PROJECT_DIR
         )
         
         await self.clients["files"].start_server(
             "filesystem", r"C:\Program Files\nodejs\npx.cmd",
-            "-y", "@modelcontextprotocol/server-filesystem", str(Path(__file__).parent)
+            "-y", "@modelcontextprotocol/server-filesystem", _PROJECT_DIR
         )
 
         await self.clients["sleep_coach"].start_server(
             "sleep_coach", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/SleepCoachServer/sleep_coach.py")
+            str(_LOCAL_SERVERS_DIR / "SleepCoachServer/sleep_coach.py")
         )
 
         await self.clients["beauty"].start_server(
             "beauty", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/beauty-palette-server-local/beauty_server.py")
+            str(_LOCAL_SERVERS_DIR / "beauty-palette-server-local/beauty_server.py")
         )
 
         await self.clients["videogames"].start_server(
             "videogames", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/MCP_VIDEOGAMES_REC_INFO/server/mcp_server.py")
+            str(_LOCAL_SERVERS_DIR / "MCP_VIDEOGAMES_REC_INFO/server/mcp_server.py")
         )
 
         await self.clients["movies"].start_server(
             "movies", sys.executable,
-            str(Path(__file__).parent.parent / "servidores locales mcp/Movies_ChatBot/movie_server.py")
+            str(_LOCAL_SERVERS_DIR / "Movies_ChatBot/movie_server.py")
         )
 
         await self.clients["remote"].start_server()
@@ -75,14 +116,17 @@ class MCPChatbot:
         return
     
     async def servers_with_llm(self):
-        # Obtener herramientas de cada servidor MCP
-        sleep_tools = await self.clients["sleep_coach"].list_tools()
-        git_tools = await self.clients["git"].list_tools()
-        files_tools = await self.clients["files"].list_tools()
-        beauty_tools = await self.clients["beauty"].list_tools()
-        videogames_tools = await self.clients["videogames"].list_tools()
-        movies_tools = await self.clients["movies"].list_tools()
-        remote_tools = await self.clients["remote"].list_tools()
+        # Obtener herramientas de cada servidor MCP (en paralelo: cada uno tiene su propio canal)
+        (sleep_tools, git_tools, files_tools, beauty_tools,
+         videogames_tools, movies_tools, remote_tools) = await asyncio.gather(
+            self.clients["sleep_coach"].list_tools(),
+            self.clients["git"].list_tools(),
+            self.clients["files"].list_tools(),
+            self.clients["beauty"].list_tools(),
+            self.clients["videogames"].list_tools(),
+            self.clients["movies"].list_tools(),
+            self.clients["remote"].list_tools(),
+        )
 
         # Construir contexto para el LLM
         llm_context = f"""
@@ -180,7 +224,7 @@ class MCPChatbot:
 
         try:
             # Enviar el contexto al LLM y registrar en la sesión
-            self.claude.send_message(llm_context)
+            await self.claude.asend_message(llm_context)
             self.session.add_message("user", llm_context)
         except Exception as e:
             print(f"❌ Error enviando contexto: {e}")
@@ -190,22 +234,7 @@ class MCPChatbot:
 
     def show_welcome_message(self):
         """Muestra mensaje de bienvenida y comandos disponibles"""
-        print("\n" + "="*60)
-        print("CHATBOT MCP CON ANTHROPIC CLAUDE - ¡Bienvenido!")
-        print("Usando Claude API (inteligencia avanzada en la nube)")
-        print("="*60)
-        print("💬 Puedes hacer preguntas normales o usar comandos especiales:")
-        print()
-        print("COMANDOS ESPECIALES:")
-        print("  /help         - Mostrar esta ayuda")
-        print("  /log          - Mostrar log de interacciones")
-        print("  /stats        - Mostrar estadísticas de la sesión")
-        print("  /context      - Mostrar resumen del contexto actual")
-        print("  /clear        - Limpiar contexto de conversación")
-        print("  /save         - Guardar sesión actual")
-        print("  /quit         - Salir del chatbot")
-        print()
-        print("="*60)
+        print(_WELCOME_TEXT)
     
     async def process_special_command(self, command: str) -> bool:
         """
@@ -217,81 +246,102 @@ class MCPChatbot:
         Returns:
             True si era un comando especial, False si no
         """
-        command = command.lower().strip()
+        # Solo se normaliza el nombre del comando; el resto conserva mayúsculas
+        name, _, _ = command.strip().partition(" ")
+        handler = self._commands.get(name.lower())
+        if handler is None:
+            return False
         
-        if command == '/help':
-            self.show_welcome_message()
-            return True
-            
-        elif command == '/log':
-            self.logger.show_interaction_log()
-            return True
-            
-        elif command == '/stats':
-            stats = self.session.get_session_stats()
-            mcp_stats = self.logger.get_mcp_stats()
-            
-            print(f"\n📊 ESTADÍSTICAS DE SESIÓN:")
-            print(f"  Total mensajes: {stats['total_messages']}")
-            print(f"  Mensajes usuario: {stats['user_messages']}")
-            print(f"  Mensajes chatbot: {stats['assistant_messages']}")
-            print(f"  Duración: {stats['session_duration']}")
-            print(f"  Mensajes en contexto: {stats['messages_in_context']}")
-            print(f"\nESTADÍSTICAS MCP:")
-            print(f"  Interacciones totales: {mcp_stats['total_interactions']}")
-            print(f"  Tasa de éxito: {mcp_stats['success_rate']:.1f}%")
-            print(f"  Servidores usados: {', '.join(mcp_stats['servers_used']) if mcp_stats['servers_used'] else 'Ninguno'}")
-            
-            return True
-            
-        elif command == '/context':
-            self.session.show_context_summary()
-            return True
-            
-        elif command == '/clear':
-            self.session.clear_context()
-            return True
-            
-        elif command == '/save':
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"session_{timestamp}.json"
-            self.session.save_session(filename)
-            return True
-            
-        elif command == '/quit':
-            return True
+        result = handler()
+        if asyncio.iscoroutine(result):
+            await result
+        return True
+    
+    def _show_stats(self) -> None:
+        """Muestra estadísticas de la sesión y de uso de MCP"""
+        stats = self.session.get_session_stats()
+        mcp_stats = self.logger.get_mcp_stats()
         
-        return False
+        print(f"\n📊 ESTADÍSTICAS DE SESIÓN:")
+        print(f"  Total mensajes: {stats['total_messages']}")
+        print(f"  Mensajes usuario: {stats['user_messages']}")
+        print(f"  Mensajes chatbot: {stats['assistant_messages']}")
+        print(f"  Duración: {stats['session_duration']}")
+        print(f"  Mensajes en contexto: {stats['messages_in_context']}")
+        print(f"\nESTADÍSTICAS MCP:")
+        print(f"  Interacciones totales: {mcp_stats['total_interactions']}")
+        print(f"  Tasa de éxito: {mcp_stats['success_rate']:.1f}%")
+        print(f"  Servidores usados: {', '.join(mcp_stats['servers_used']) if mcp_stats['servers_used'] else 'Ninguno'}")
+    
+    async def _save_session_command(self) -> None:
+        """Guarda la sesión actual con un nombre basado en la fecha"""
+        filename = f"session_{datetime.now().strftime(_TS_FMT)}.json"
+        # Escribir el archivo en un hilo para no bloquear el event loop
+        await asyncio.to_thread(self.session.save_session, filename)
 
 
     async def handle_tool_result(self, user_input, result):
         # Detectar si es JSON o se puede parsear
         try:
-            result_json = json.dumps(json.loads(result), ensure_ascii=False, indent=2)
+            json.loads(result)
         except json.JSONDecodeError:
             # no es json válido → devuélvelo tal cual
             return str(result)
+        
+        # El texto del servidor ya es JSON válido: se pasa tal cual, sin re-serializarlo
+        result_json = result
 
-        llm_response = self.claude.send_message(f"El usuario preguntó: {user_input}\n\nAquí tienes el resultado del servidor:\n\n{result_json}\n\nParsea esto en un texto claro y útil para el usuario.", 
+        llm_response = await self.claude.asend_message(f"El usuario preguntó: {user_input}\n\nAquí tienes el resultado del servidor:\n\n{result_json}\n\nParsea esto en un texto claro y útil para el usuario.", 
                                                 conversation_history=[{"role": "system", "content": "Eres un asistente que convierte JSON en respuestas amigables. Sin añadir demasiada información extra."}])
 
         return llm_response
 
 
-    async def process_user_message(self, message: str) -> str:
+    async def _run_tool_call(self, message: str, parsed: dict, llm_response: str) -> str:
+        """
+        Ejecuta una llamada a herramienta pedida por el LLM
+        
+        Args:
+            message: Mensaje original del usuario
+            parsed: Elemento del JSON devuelto por el LLM
+            llm_response: Respuesta completa del LLM (se usa si no es una llamada a herramienta)
+            
+        Returns:
+            Parte de la respuesta final correspondiente a esta llamada
+        """
+        if parsed.get("action") != "call_tool":
+            return llm_response
+        
+        server_name = parsed["server"]
+        tool = parsed["tool"]
+        args = parsed.get("arguments", {})
+        
+        if server_name not in self.clients:
+            error = f"❌ Servidor desconocido: {server_name}"
+            self.logger.log_mcp_interaction(server_name, tool, args, None, False, error=error)
+            return error
+        
+        if server_name == "remote":
+            result = await self.clients[server_name].call_endpoint(tool, args)
+        else:
+            result = await self.clients[server_name].call_tool(tool, args)
+        self.logger.log_mcp_interaction(server_name, tool, args, result)
+        return await self.handle_tool_result(message, result)
+
+    async def process_user_message(self, message: str, on_text=None) -> str:
         """
         Procesa mensaje del usuario y genera respuesta
         
         Args:
             message: Mensaje del usuario
+            on_text: Función que recibe la respuesta del LLM en streaming (opcional)
             
         Returns:
             Respuesta del chatbot
         """
         context = self.session.get_context()
         # Preguntar al LLM qué hacer
-        llm_response = self.claude.send_message(message, context)
-        final_answer = ""
+        llm_response = await self.claude.astream_message(message, context, on_text)
         # Intentar interpretar como JSON
         try:
             parsed_json = json.loads(llm_response)
@@ -300,33 +350,17 @@ class MCPChatbot:
             if isinstance(parsed_json, dict):
                 parsed_json = [parsed_json]
 
+            # Una llamada puede depender de la anterior (crear perfil → pedir consejo, escribir
+            # archivo → git add/commit): se ejecutan una a una en el orden del arreglo
+            parts = []
             for parsed in parsed_json:
-                if parsed.get("action") == "call_tool":
-                    server_name = parsed["server"]
-                    tool = parsed["tool"]
-                    args = parsed.get("arguments", {})
-
-                    if server_name in self.clients:
-                        if server_name == "remote":
-                            result = await self.clients[server_name].call_endpoint(tool, args)
-                        else:
-                            result = await self.clients[server_name].call_tool(tool, args)
-                        self.logger.log_mcp_interaction(server_name, tool, args, result)
-                        final_answer = final_answer + "\n\n" +await self.handle_tool_result(message, result)
-                        
-                    else:
-                        final_answer = f"❌ Servidor desconocido: {server_name}"
-                        self.logger.log_mcp_interaction(server_name, tool, args, result, False, error=final_answer)
-                else:
-                    final_answer = final_answer + "\n\n" + llm_response
+                parts.append(await self._run_tool_call(message, parsed, llm_response))
+            final_answer = "".join("\n\n" + part for part in parts)
 
         except json.JSONDecodeError:
             # No era JSON → respuesta normal del LLM
             final_answer = llm_response
 
-        # Guardar respuesta en historial
-        self.session.add_message("assistant", final_answer)
-        
         return final_answer
     
     async def _async_run(self):
@@ -337,7 +371,7 @@ class MCPChatbot:
         try:
             while True:
                 # Obtener entrada del usuario
-                user_input = await asyncio.to_thread(input, "\n👤 Tú: ")
+                user_input = await ainput("\n👤 Tú: ")
                 user_input = user_input.strip()
 
                 # Comandos especiales
@@ -352,23 +386,20 @@ class MCPChatbot:
                     print("💭 Por favor ingresa un mensaje o usa /help para ver comandos")
                     continue
 
-                # Registrar entrada del usuario
-                self.logger.log_user_input(user_input, self.session_id)
-
                 # Procesar mensaje
                 print("🤔 Pensando...")
-                response = await self.process_user_message(user_input)
+                printer = StreamPrinter()
+                response = await self.process_user_message(user_input, on_text=printer)
 
-                # Agregar al contexto
-                self.session.add_message("user", user_input)
-                self.session.add_message("assistant", response)
+                # El texto normal ya se mostró en vivo; las respuestas de herramientas se imprimen aquí
+                printer.finish(response)
 
-                # Registrar respuesta
-                estimated_tokens = self.claude.estimate_tokens(response)
-                self.logger.log_anthropic_response(response, estimated_tokens, self.session_id)
+                # Agregar el turno completo al contexto (un solo recorte)
+                self.session.add_messages([("user", user_input), ("assistant", response)])
 
-                # Mostrar respuesta
-                print(f"\n🤖 Chatbot: {response}")
+                # Registrar el turno completo (solo encola; el hilo del logger escribe a disco)
+                estimated_tokens = self.claude.estimate_tokens(response)
+                self.logger.log_turn(Turn(self.session_id, user_input, response, estimated_tokens))
 
         finally:
             # Cerrar todos los clientes al salir del loop
@@ -382,16 +413,10 @@ class MCPChatbot:
         self.show_welcome_message()
         
         try:
-            # Iniciar loop asyncio si no está corriendo
-            try:
-                loop = asyncio.get_running_loop()
-            except RuntimeError:
-                # No hay loop corriendo, crear uno nuevo
-                asyncio.run(self._async_run())
-                return
-            
-            # Si ya hay un loop, usar run_until_complete
-            loop.run_until_complete(self._async_run())
+            # Un solo loop asyncio para toda la sesión (servidores, entrada y cierre);
+            # con uvloop si está instalado
+            set_uvloop()
+            asyncio.run(self._async_run())
                 
         except KeyboardInterrupt:
             print("\n\n🛑 Chatbot interrumpido por el usuario")
@@ -401,10 +426,11 @@ class MCPChatbot:
         finally:
             # Guardar sesión al salir
             self.session.save_session(f"{self.session_id}.json")
+            self.logger.close()
             print("Sesión guardada automáticamente")
             print("¡Hasta luego!")
             
 
 
 if __name__ == "__main__":
-    asyncio.run(MCPChatbot().run())
\ No newline at end of file
+    MCPChatbot().run()
\ No newline at end of file
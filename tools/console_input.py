@@ -0,0 +1,44 @@
+# src/chatbot/console_input.py
+import asyncio
+import threading
+
+
+async def ainput(prompt: str = "") -> str:
+    """
+    Lee una línea de la terminal sin bloquear el event loop
+
+    input() corre en un hilo daemon propio y no en el executor por defecto: si el usuario
+    sale con Ctrl+C mientras el hilo sigue esperando Enter, asyncio.run no se queda
+    esperándolo al cerrar y el intérprete puede terminar igual.
+
+    Args:
+        prompt: Texto que se muestra antes de leer
+
+    Returns:
+        La línea leída, sin el salto de línea final
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(result=None, error=None):
+        if future.done():  # Cancelada (Ctrl+C) mientras se esperaba la línea
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def read_line():
+        try:
+            line = input(prompt)
+        except BaseException as e:  # EOFError, KeyboardInterrupt...
+            callback = (deliver, None, e)
+        else:
+            callback = (deliver, line)
+        try:
+            loop.call_soon_threadsafe(*callback)
+        except RuntimeError:  # El loop ya se cerró
+            pass
+
+    threading.Thread(target=read_line, name="console-input", daemon=True).start()
+    return await future
@@ -1,12 +1,77 @@
 # src/chatbot/logger.py
 import logging
+import logging.handlers
+import atexit
+import collections
+from collections import namedtuple
+import io
 import json
+import mmap
 import os
-from datetime import datetime
-from typing import Dict, Any, Optional
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, date
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """Serializa a JSON compacto (orjson si está disponible)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=str, option=option)
+    return json.dumps(obj, ensure_ascii=False, default=str, sort_keys=sort_keys).encode('utf-8')
+
+
+def _dumps_line(obj: Any) -> bytes:
+    """Serializa una línea JSONL terminada en salto de línea"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return _dumps(obj) + b"\n"
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+_BANNER = "=" * 60
+_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+_LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL,
+}
+
+# fdatasync evita sincronizar metadatos del inodo; no existe en Windows
+_datasync = getattr(os, 'fdatasync', os.fsync)
+
+
+# Un turno completo de conversación (entrada del usuario + respuesta)
+Turn = namedtuple('Turn', 'session_id user assistant tokens')
+
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    """Detiene un QueueListener, vacía sus buffers y cierra sus handlers"""
+    listener.stop()
+    for handler in listener.handlers:
+        # MemoryHandler.close() vacía el buffer pero no cierra (y suelta) su destino
+        target = getattr(handler, 'target', None)
+        handler.close()
+        if target is not None:
+            target.close()
+
+
 class InteractionLogger:
+    MAX_MEMORY_INTERACTIONS = 1000
+    COALESCE_WINDOW = 1.0  # segundos
+    
     def __init__(self, log_dir: str = "logs", log_level: str = "INFO"):
         """
         Inicializa el sistema de logging para interacciones MCP
@@ -16,58 +81,122 @@ class InteractionLogger:
             log_level: Nivel de logging (DEBUG, INFO, WARNING, ERROR)
         """
         self.log_dir = Path(log_dir)
-        self.log_dir.mkdir(exist_ok=True)
+        if not self.log_dir.exists():
+            self.log_dir.mkdir(parents=True, exist_ok=True)
         
         # Archivo principal de log
         self.log_file = self.log_dir / "interactions.log"
         
-        # Archivo específico para MCP
-        self.mcp_log_file = self.log_dir / "mcp_interactions.json"
+        # Archivo específico para MCP (JSON Lines, uno por día)
+        self.mcp_log_file = self.log_dir / f"mcp_{date.today():%Y%m%d}.jsonl"
         
         # Configurar logging principal
         self._setup_logging(log_level)
         
-        # Lista para almacenar interacciones MCP en memoria
-        self.mcp_interactions = []
+        # Últimas interacciones MCP en memoria; el archivo JSONL guarda el historial completo
+        self.mcp_interactions = collections.deque(maxlen=self.MAX_MEMORY_INTERACTIONS)
+        
+        # Contadores acumulados para get_mcp_stats (archivo del día + sesión actual)
+        self._stats = {'total': 0, 'successful': 0, 'server_counts': collections.Counter()}
         
         # Cargar interacciones MCP existentes
         self._load_mcp_interactions()
+        
+        # Handle persistente en modo append; se vacía cada N eventos o T segundos
+        fd = os.open(self.mcp_log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._mcp_handle = os.fdopen(fd, 'ab', buffering=8192)
+        # Si la última línea quedó cortada, terminarla para no pegarle el siguiente registro
+        if self._last_byte(self.mcp_log_file) not in (b"", b"\n"):
+            self._mcp_handle.write(b"\n")
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        
+        # Hilo de fondo que escribe las interacciones MCP fuera del loop principal
+        self._mcp_queue = queue.Queue()
+        
+        # Última interacción exitosa retenida para agrupar repeticiones idénticas
+        self._held = None
+        self._held_lock = threading.Lock()
+        self._mcp_writer = threading.Thread(target=self._mcp_worker, name="MCPLogWriter", daemon=True)
+        self._mcp_writer.start()
+        atexit.register(self.close)
     
     def _setup_logging(self, log_level: str) -> None:
-        """Configura el sistema de logging"""
-        
-        # Crear formatter
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        """Configura el sistema de logging (una sola vez por archivo de log)"""
         
         # Configurar logger principal
         self.logger = logging.getLogger('MCPChatbot')
-        self.logger.setLevel(getattr(logging, log_level.upper()))
+        name = log_level.upper()
+        # Los demás nombres válidos (WARN, FATAL, NOTSET) se resuelven como antes
+        level = _LEVELS.get(name)
+        self.logger.setLevel(level if level is not None else getattr(logging, name))
+        
+        # Si ya está configurado para este archivo, reutilizar el listener existente
+        # (se cuenta cuántas instancias lo usan: solo la última en cerrar lo detiene)
+        if getattr(self.logger, '_mcp_log_file', None) == self.log_file:
+            self._listener = self.logger._mcp_listener
+            self.logger._mcp_listener_refs += 1
+            return
+        
+        # Configurado para otro archivo: detener el listener anterior y cerrar sus handlers
+        previous = getattr(self.logger, '_mcp_listener', None)
+        if previous is not None:
+            _stop_listener(previous)
+        
+        # Crear formatter
+        formatter = logging.Formatter(_LOG_FORMAT)
         
         # Handler para archivo
-        file_handler = logging.FileHandler(self.log_file, encoding='utf-8')
+        file_handler = logging.handlers.RotatingFileHandler(
+            self.log_file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8'
+        )
         file_handler.setFormatter(formatter)
         
+        # Buffer en memoria: escribe al archivo en lotes o de inmediato ante un ERROR
+        memory_handler = logging.handlers.MemoryHandler(
+            capacity=256, flushLevel=logging.ERROR, target=file_handler, flushOnClose=True
+        )
+        
         # Handler para consola (solo WARNING y ERROR)
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.WARNING)
         console_handler.setFormatter(formatter)
         
-        # Limpiar handlers existentes y agregar nuevos
+        # Los registros se encolan y un hilo de fondo los escribe en los handlers
+        log_queue = queue.Queue()
+        self._listener = logging.handlers.QueueListener(
+            log_queue, memory_handler, console_handler, respect_handler_level=True
+        )
+        self._listener.start()
+        
+        # Limpiar handlers existentes y agregar el de la cola
         self.logger.handlers = []
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        
+        self.logger._mcp_listener = self._listener
+        self.logger._mcp_log_file = self.log_file
+        self.logger._mcp_listener_refs = 1
     
     def log_user_input(self, message: str, session_id: str = None) -> None:
         """Registra entrada del usuario"""
-        self.logger.info(f"USER_INPUT | Session: {session_id} | Message: {message}")
+        self.logger.info("USER_INPUT | Session: %s | Message: %s", session_id, message)
     
     def log_anthropic_response(self, response: str, tokens_used: int = None, session_id: str = None) -> None:
         """Registra respuesta de Anthropic"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         response_preview = response[:200] + "..." if len(response) > 200 else response
         token_info = f" | Tokens: {tokens_used}" if tokens_used else ""
-        self.logger.info(f"ANTHROPIC_RESPONSE | Session: {session_id}{token_info} | Response: {response_preview}")
+        self.logger.info("ANTHROPIC_RESPONSE | Session: %s%s | Response: %s", session_id, token_info, response_preview)
+    
+    def log_turn(self, turn: Turn) -> None:
+        """Registra un turno completo (entrada y respuesta) en un solo registro"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        response_preview = turn.assistant[:200] + "..." if len(turn.assistant) > 200 else turn.assistant
+        token_info = f" | Tokens: {turn.tokens}" if turn.tokens else ""
+        self.logger.info("TURN | Session: %s%s | User: %s | Response: %s",
+                         turn.session_id, token_info, turn.user, response_preview)
     
     def log_mcp_interaction(self, server_name: str, action: str, parameters: Dict = None, 
                            result: Any = None, success: bool = True, error: str = None) -> None:
@@ -82,59 +211,188 @@ class InteractionLogger:
             success: Si la operación fue exitosa
             error: Mensaje de error si falló
         """
+        now = datetime.now()
         interaction = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
+            'ts_display': now.strftime('%H:%M:%S'),
             'server': server_name,
             'action': action,
             'parameters': parameters or {},
             'success': success,
             'result': self._sanitize_result(result) if success else None,
-            'error': error if not success else None
+            'error': error if not success else None,
+            'count': 1
         }
+        # Claves ordenadas: los mismos parámetros en otro orden cuentan como la misma llamada
+        key = (server_name, action, _dumps(interaction['parameters'], sort_keys=True))
         
-        # Agregar a la lista en memoria
-        self.mcp_interactions.append(interaction)
+        with self._held_lock:
+            held = self._held
+            # Misma llamada exitosa dentro de la ventana: solo se incrementa el contador del JSONL
+            coalesced = (success and held is not None and held[0] == key
+                         and time.monotonic() - held[1] < self.COALESCE_WINDOW)
+            if coalesced:
+                held[2]['count'] += 1
+            else:
+                # La retenida anterior ya no puede crecer: encolarla para el archivo JSONL
+                if held is not None:
+                    self._mcp_queue.put(held[2])
+                
+                # Los errores se escriben de inmediato, sin agrupar
+                if success:
+                    self._held = (key, time.monotonic(), interaction)
+                else:
+                    self._held = None
+                    self._mcp_queue.put(interaction)
         
-        # Guardar en archivo JSON
-        self._save_mcp_interactions()
+        # Agregar a la lista en memoria (las repeticiones ya cuentan en la retenida)
+        if not coalesced:
+            self.mcp_interactions.append(interaction)
+        self._update_stats(interaction)
         
         # Log en archivo principal
-        status = "SUCCESS" if success else "ERROR"
-        log_msg = f"MCP_INTERACTION | {status} | Server: {server_name} | Action: {action}"
-        
         if success:
-            self.logger.info(log_msg + f" | Result: {str(result)[:100]}...")
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("MCP_INTERACTION | SUCCESS | Server: %s | Action: %s | Result: %s...",
+                                 server_name, action, str(result)[:100])
         else:
-            self.logger.error(log_msg + f" | Error: {error}")
+            self.logger.error("MCP_INTERACTION | ERROR | Server: %s | Action: %s | Error: %s",
+                              server_name, action, error)
     
     def _sanitize_result(self, result: Any) -> Any:
         """Sanitiza el resultado para evitar logs muy largos"""
         if isinstance(result, str) and len(result) > 1000:
             return result[:1000] + f"... [truncado, {len(result)} caracteres totales]"
         elif isinstance(result, (list, dict)):
-            result_str = json.dumps(result, indent=2)
-            if len(result_str) > 1000:
+            # Más de 100 elementos no cabe en 1000 caracteres: no hace falta serializar
+            if len(result) > 100 or len(_dumps(result)) > 1000:
                 return f"[Objeto grande truncado: {type(result).__name__} con {len(result)} elementos]"
         return result
     
+    @staticmethod
+    def _last_byte(path: Path) -> bytes:
+        """Último byte de un archivo (vacío si no tiene contenido)"""
+        with open(path, 'rb') as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return b""
+            f.seek(-1, os.SEEK_END)
+            return f.read(1)
+    
+    @staticmethod
+    def _iter_jsonl(path: Path):
+        """Itera las interacciones de un archivo JSONL, una línea a la vez"""
+        if not path.exists():
+            return
+        with open(path, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield _loads(line)
+                except ValueError:
+                    # Línea cortada (p. ej. el proceso murió a mitad de un append): se salta
+                    logging.getLogger('MCPChatbot').warning(
+                        "Línea %d inválida en %s, se ignora", number, path.name)
+    
+    def iter_all_interactions(self):
+        """Itera el historial MCP completo, recorriendo los archivos diarios en orden"""
+        for path in sorted(self.log_dir.glob("mcp_*.jsonl")):
+            yield from self._iter_jsonl(path)
+    
     def _load_mcp_interactions(self) -> None:
         """Carga interacciones MCP existentes desde archivo"""
         try:
-            if self.mcp_log_file.exists():
-                with open(self.mcp_log_file, 'r', encoding='utf-8') as f:
-                    self.mcp_interactions = json.load(f)
+            # Solo se carga el archivo del día; en memoria queda su cola
+            for interaction in self._iter_jsonl(self.mcp_log_file):
+                self.mcp_interactions.append(interaction)
+                self._update_stats(interaction)
         except Exception as e:
             self.logger.warning(f"No se pudieron cargar interacciones MCP previas: {e}")
-            self.mcp_interactions = []
+            self.mcp_interactions.clear()
+            self._stats = {'total': 0, 'successful': 0, 'server_counts': collections.Counter()}
+    
+    def _update_stats(self, interaction: Dict) -> None:
+        """Actualiza los contadores acumulados con una interacción"""
+        n = interaction.get('count', 1)
+        self._stats['total'] += n
+        if interaction['success']:
+            self._stats['successful'] += n
+        self._stats['server_counts'][interaction['server']] += n
+    
+    def _mcp_worker(self) -> None:
+        """Consume la cola de interacciones MCP y las escribe en disco"""
+        while True:
+            try:
+                interaction = self._mcp_queue.get(timeout=0.5)
+            except queue.Empty:
+                # Sin actividad: escribir la retenida si su ventana ya cerró y vaciar lo pendiente
+                self._release_held(only_expired=True)
+                if self._pending:
+                    self._flush_mcp()
+                continue
+            
+            if interaction is None:
+                break
+            self._save_mcp_interactions(interaction)
+    
+    def _release_held(self, only_expired: bool = False) -> None:
+        """Encola la interacción retenida para escribirla en disco"""
+        with self._held_lock:
+            held = self._held
+            if held is None:
+                return
+            if only_expired and time.monotonic() - held[1] < self.COALESCE_WINDOW:
+                return
+            self._held = None
+            self._mcp_queue.put(held[2])
     
-    def _save_mcp_interactions(self) -> None:
-        """Guarda interacciones MCP en archivo JSON"""
+    def _save_mcp_interactions(self, interaction: Dict) -> None:
+        """Agrega una interacción MCP al archivo JSONL"""
         try:
-            with open(self.mcp_log_file, 'w', encoding='utf-8') as f:
-                json.dump(self.mcp_interactions, f, indent=2, ensure_ascii=False)
+            self._mcp_handle.write(_dumps_line(interaction))
+            self._pending += 1
+            
+            # Vaciar a disco cada 50 eventos o cada 0.5 segundos; los errores de inmediato
+            if (not interaction['success'] or self._pending >= 50
+                    or time.monotonic() - self._last_flush > 0.5):
+                self._flush_mcp()
         except Exception as e:
             self.logger.error(f"Error guardando interacciones MCP: {e}")
     
+    def _flush_mcp(self) -> None:
+        """Vacía el buffer del archivo MCP a disco"""
+        self._mcp_handle.flush()
+        _datasync(self._mcp_handle.fileno())
+        self._pending = 0
+        self._last_flush = time.monotonic()
+    
+    def close(self) -> None:
+        """Detiene los hilos de escritura, vacía lo pendiente y cierra los archivos"""
+        handle = getattr(self, '_mcp_handle', None)
+        if handle is None or handle.closed:
+            return
+        
+        # Drenar la cola MCP (incluida la retenida) antes de cerrar el archivo
+        self._release_held()
+        self._mcp_queue.put(None)
+        self._mcp_writer.join()
+        try:
+            self._flush_mcp()
+        finally:
+            handle.close()
+            # El listener es compartido; solo lo detiene la última instancia que lo usa
+            if self._listener_active():
+                self.logger._mcp_listener_refs -= 1
+                if self.logger._mcp_listener_refs == 0:
+                    self.logger.handlers = []
+                    _stop_listener(self._listener)
+                    self.logger._mcp_listener = None
+                    self.logger._mcp_log_file = None
+    
+    def _listener_active(self) -> bool:
+        """Indica si el listener de esta instancia sigue siendo el que atiende al logger"""
+        return getattr(self.logger, '_mcp_listener', None) is self._listener
+    
     def show_interaction_log(self, lines: int = 50) -> None:
         """
         Muestra las últimas líneas del log de interacciones
@@ -142,44 +400,98 @@ class InteractionLogger:
         Args:
             lines: Número de líneas a mostrar
         """
+        # Esperar a que el listener procese la cola y escribir lo que siga en memoria
+        # (si ya se detuvo, la cola no se vacía nunca y su contenido ya está en disco)
+        if self._listener_active():
+            self._listener.queue.join()
+            for handler in self._listener.handlers:
+                handler.flush()
+        
         try:
-            with open(self.log_file, 'r', encoding='utf-8') as f:
-                all_lines = f.readlines()
-                
-            print(f"\n{'='*60}")
-            print(f"📄 LOG DE INTERACCIONES (últimas {lines} líneas)")
-            print(f"{'='*60}")
+            tail = self._read_tail(self.log_file, lines)
             
-            for line in all_lines[-lines:]:
-                print(line.rstrip())
-                
-            print(f"{'='*60}\n")
+            sys.stdout.write(f"\n{_BANNER}\n📄 LOG DE INTERACCIONES (últimas {lines} líneas)\n{_BANNER}\n")
+            sys.stdout.writelines(tail)
+            sys.stdout.write(f"{_BANNER}\n\n")
+            sys.stdout.flush()
             
         except FileNotFoundError:
             print("📭 No hay log de interacciones disponible aún.")
     
+    @staticmethod
+    def _read_tail(path: Path, lines: int) -> List[str]:
+        """Lee las últimas líneas de un archivo mapeándolo en memoria y buscando desde el final"""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Ignorar el salto de línea final y retroceder línea por línea
+                end = len(mm) - 1 if mm[-1:] == b"\n" else len(mm)
+                pos = end
+                for _ in range(lines):
+                    pos = mm.rfind(b"\n", 0, pos)
+                    if pos < 0:
+                        break
+                tail = mm[pos + 1:end]
+        
+        return [line + "\n" for line in tail.decode('utf-8', errors='replace').splitlines()]
+    
+    def show_mcp_interactions(self, limit: int = 20, server_filter: Optional[str] = None) -> None:
+        """
+        Muestra las últimas interacciones MCP registradas
+        
+        Args:
+            limit: Número máximo de interacciones a mostrar
+            server_filter: Mostrar solo las de este servidor
+        """
+        interactions = [
+            i for i in self.mcp_interactions
+            if server_filter is None or i['server'] == server_filter
+        ][-limit:]
+        
+        if not interactions:
+            print("📭 No hay interacciones MCP registradas.")
+            return
+        
+        # Construir toda la salida y escribirla de una vez
+        buf = io.StringIO()
+        buf.write(f"\n{_BANNER}\n")
+        buf.write(f"🔌 INTERACCIONES MCP (últimas {len(interactions)})\n")
+        buf.write(f"{_BANNER}\n")
+        
+        for interaction in interactions:
+            # Registros anteriores a 'ts_display' se formatean al vuelo
+            time_str = interaction.get('ts_display') or datetime.fromisoformat(interaction['timestamp']).strftime('%H:%M:%S')
+            status_icon = "✅" if interaction['success'] else "❌"
+            repeat = f" (x{interaction['count']})" if interaction.get('count', 1) > 1 else ""
+            buf.write(f"{status_icon} [{time_str}] {interaction['server']} → {interaction['action']}{repeat}\n")
+            if interaction['parameters']:
+                buf.write(f"   Parámetros: {interaction['parameters']}\n")
+            if interaction['success']:
+                buf.write(f"   Resultado: {str(interaction['result'])[:100]}\n")
+            else:
+                buf.write(f"   Error: {interaction['error']}\n")
+        
+        buf.write(f"{_BANNER}\n\n")
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
+    
     def get_mcp_stats(self) -> Dict[str, Any]:
         """Retorna estadísticas de uso de servidores MCP"""
-        if not self.mcp_interactions:
+        total = self._stats['total']
+        if not total:
             return {"total_interactions": 0, "servers_used": [], "success_rate": 0}
         
-        total = len(self.mcp_interactions)
-        successful = len([i for i in self.mcp_interactions if i['success']])
-        servers = list(set(i['server'] for i in self.mcp_interactions))
-        
-        # Conteo por servidor
-        server_counts = {}
-        for interaction in self.mcp_interactions:
-            server = interaction['server']
-            server_counts[server] = server_counts.get(server, 0) + 1
+        successful = self._stats['successful']
+        server_counts = self._stats['server_counts']
         
         return {
             "total_interactions": total,
             "successful_interactions": successful,
-            "success_rate": (successful / total * 100) if total > 0 else 0,
-            "servers_used": servers,
-            "interactions_per_server": server_counts,
-            "most_used_server": max(server_counts.items(), key=lambda x: x[1])[0] if server_counts else None
+            "success_rate": successful / total * 100,
+            "servers_used": list(server_counts),
+            "interactions_per_server": dict(server_counts),
+            "most_used_server": server_counts.most_common(1)[0][0]
         }
 
 
@@ -1,8 +1,25 @@
 # src/chatbot/session_manager.py
 import os
 import json
+from collections import Counter
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _dumps_pretty(obj) -> bytes:
+    """Serializa a JSON indentado en UTF-8 (orjson si está disponible)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False, default=str).encode('utf-8')
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+
 
 class SessionManager:
     def __init__(self, max_context_messages: int = 20):
@@ -42,6 +59,26 @@ class SessionManager:
         # Mantener solo los últimos N mensajes para evitar exceder límites de tokens
         self._trim_context()
     
+    def add_messages(self, messages: List[Tuple[str, str]]) -> None:
+        """
+        Agrega varios mensajes de una vez (p. ej. el turno usuario + asistente),
+        recortando el contexto una sola vez al final
+        
+        Args:
+            messages: Lista de tuplas (role, content)
+        """
+        timestamp = datetime.now().isoformat()
+        for role, content in messages:
+            self.conversation_history.append({
+                "role": role,
+                "content": content,
+                "timestamp": timestamp,
+                "message_id": self.message_count
+            })
+            self.message_count += 1
+        
+        self._trim_context()
+    
     def get_context(self) -> List[Dict]:
         """
         Retorna el contexto actual de la conversación en formato para Anthropic API
@@ -99,8 +136,10 @@ class SessionManager:
                 "messages_in_context": 0
             }
         
-        user_msgs = len([msg for msg in self.conversation_history if msg["role"] == "user"])
-        assistant_msgs = len([msg for msg in self.conversation_history if msg["role"] == "assistant"])
+        # Un solo recorrido para contar mensajes por rol
+        role_counts = Counter(msg["role"] for msg in self.conversation_history)
+        user_msgs = role_counts["user"]
+        assistant_msgs = role_counts["assistant"]
         
         duration = datetime.now() - self.session_start
         duration_minutes = duration.total_seconds() / 60
@@ -141,12 +180,55 @@ class SessionManager:
         }
         
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(session_data, f, indent=2, ensure_ascii=False)
+            self._write_atomic(filepath, _dumps_pretty(session_data))
             print(f"💾 Sesión guardada en: {filepath}")
         except Exception as e:
             print(f"❌ Error guardando sesión: {str(e)}")
     
+    @staticmethod
+    def _write_atomic(filepath: str, data: bytes) -> None:
+        """
+        Escribe el archivo completo en un temporal, lo sincroniza a disco y lo renombra
+        encima del destino, así ni un cierre ni un corte de luz dejan un JSON truncado
+        
+        Args:
+            filepath: Ruta final del archivo
+            data: Contenido a escribir
+        """
+        tmp_path = filepath + ".tmp"
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        fd = os.open(tmp_path, flags, 0o644)
+        try:
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                # El contenido debe estar en disco antes del rename
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            # No dejar el temporal a medias si falló la escritura o el rename
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        
+        # Sincronizar el directorio para que el rename también sobreviva (no se puede en Windows)
+        try:
+            dir_fd = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+    
     def load_session(self, filename: str) -> bool:
         """
         Carga una sesión desde un archivo JSON
@@ -158,8 +240,8 @@ class SessionManager:
             True si se cargó exitosamente, False en caso contrario
         """
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                session_data = json.load(f)
+            with open(filename, 'rb') as f:
+                session_data = _loads(f.read())
             
             self.conversation_history = session_data.get("conversation_history", [])
             self.message_count = session_data.get("session_info", {}).get("total_messages", 0)
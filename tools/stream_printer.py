@@ -0,0 +1,58 @@
+# src/chatbot/stream_printer.py
+import sys
+
+
+class StreamPrinter:
+    def __init__(self, prefix: str = "\n🤖 Chatbot: "):
+        """
+        Imprime la respuesta del LLM a medida que llega en streaming
+
+        Las llamadas a herramientas llegan como JSON y no se deben mostrar al usuario,
+        así que se acumula el inicio de la respuesta hasta ver el primer carácter:
+        si empieza con '{' o '[' no se imprime nada, si no se imprime todo en vivo.
+
+        Args:
+            prefix: Texto que se muestra antes del primer fragmento
+        """
+        self.prefix = prefix
+        self.streamed = False
+        self._decided = False
+        self._head = []
+        self._chunks = []
+
+    def __call__(self, text: str) -> None:
+        """Recibe un fragmento de texto del LLM"""
+        self._chunks.append(text)
+        if self._decided:
+            if self.streamed:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            return
+
+        self._head.append(text)
+        head = "".join(self._head).lstrip()
+        if not head:
+            return
+
+        self._decided = True
+        self.streamed = head[0] not in "{["
+        if self.streamed:
+            sys.stdout.write(self.prefix + head)
+            sys.stdout.flush()
+        self._head = []
+
+    def finish(self, response: str) -> None:
+        """
+        Cierra la salida del turno: termina la línea si la respuesta ya se mostró en vivo,
+        o imprime la respuesta completa si no (JSON de herramienta, error a mitad del stream...)
+
+        Args:
+            response: Respuesta final del chatbot
+        """
+        if self.streamed and "".join(self._chunks).strip() == response:
+            sys.stdout.write("\n")
+        else:
+            if self.streamed:
+                sys.stdout.write("\n")
+            sys.stdout.write(f"{self.prefix}{response}\n")
+        sys.stdout.flush()